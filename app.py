@@ -1,7 +1,12 @@
+import io
+import threading
+
 import streamlit as st
 import numpy as np
-import matplotlib.pyplot as plt
 import pandas as pd
+import altair as alt
+
+from model import MATH_ERRORS, calculate_curves, unpack_params
 
 st.set_page_config(layout="wide", page_title="增强激励机制价格模型分析器", page_icon="📈")
 
@@ -17,6 +22,14 @@ PARAM_RANGES = {
     "N": (1.0, 500.0, "实际人数 (N)"),
 }
 
+# 图表横轴人数网格，模块加载时生成一次，各次重跑共享（只读）
+# 默认150点已足够平滑；高精度模式使用等比网格，在小N处（导数变化最快）加密采样
+# 图表和数据表只需约6位有效数字，网格使用单精度，曲线计算结果也随之为单精度
+N_GRID = np.linspace(1, 200, 150, dtype=np.float32)
+N_GRID.setflags(write=False)
+N_GRID_HIGH_RES = np.geomspace(1, 200, 300, dtype=np.float32)
+N_GRID_HIGH_RES.setflags(write=False)
+
 # 初始化参数 - 优化后的默认值
 if 'params' not in st.session_state:
     st.session_state.params = {
@@ -58,81 +71,39 @@ with st.sidebar:
         # 当前值
         current_value = st.session_state.params[param]
         
-        # 使用统一的浮点数输入控件
+        # 使用统一的浮点数输入控件（参数范围和默认值均为浮点数，返回值也是浮点数）
         value = st.number_input(
             label, 
-            min_value=float(min_val), 
-            max_value=float(max_val), 
-            value=float(current_value),
+            min_value=min_val, 
+            max_value=max_val, 
+            value=current_value,
             step=0.1,
             format="%.1f",
             key=f"{param}_input"
         )
         
         # 更新参数值
-        st.session_state.params[param] = float(value)
+        st.session_state.params[param] = value
     
     st.markdown("---")
     
+    st.checkbox("显示图表", value=True, key="show_plot")
+    high_res = st.checkbox("高精度曲线", value=False, help="在小人数区间加密采样，曲线更精细")
+    
     # 计算按钮
     if st.button("🔄 重新计算", use_container_width=True):
         st.rerun()
 
-# 计算函数 - 改进的价格模型
-def calculate_price(N, params):
-    """计算价格函数 P(N) = P_min + K*exp(-q*(N/N0)) + C/(1+(N/N1)^r)"""
-    P_min = params["P_min"]
-    K = params["K"]
-    q = params["q"]
-    N0 = params["N0"]
-    C = params["C"]
-    r = params["r"]
-    N1 = params["N1"]
-    
-    # 避免除以零错误
-    if N0 <= 0:
-        N0 = 1.0
-    if N1 <= 0:
-        N1 = 1.0
-    
-    # 确保N大于0
-    N = max(N, 0.1)
-    
-    exp_part = K * np.exp(-q * (N / N0))
-    hyperbolic_part = C / (1 + (N / N1) ** r)
-    
-    return P_min + exp_part + hyperbolic_part
-
-def calculate_price_derivative(N, params, h=1e-5):
-    """数值计算一阶导数 P'(N)"""
-    return (calculate_price(N + h, params) - calculate_price(N - h, params)) / (2 * h)
-
-def calculate_income(N, params):
-    """计算收入函数 I(N) = P(N) * N"""
-    return calculate_price(N, params) * N
-
-def calculate_income_derivative(N, params, h=1e-5):
-    """数值计算收入的一阶导数 I'(N)"""
-    return (calculate_income(N + h, params) - calculate_income(N - h, params)) / (2 * h)
-
-def calculate_income_second_derivative(N, params, h=1e-5):
-    """数值计算收入的二阶导数 I''(N)"""
-    return (calculate_income(N + h, params) - 
-            2 * calculate_income(N, params) + 
-            calculate_income(N - h, params)) / (h**2)
-
 # 获取当前参数
 params = st.session_state.params
 N = params["N"]
+# 参数只在此处解包一次，之后以位置参数传递，避免计算函数内反复查字典
+model_args = unpack_params(params)
 
 # 计算当前值
 try:
-    current_price = calculate_price(N, params)
-    current_income = calculate_income(N, params)
-    dP_dN = calculate_price_derivative(N, params)
-    dI_dN = calculate_income_derivative(N, params)
-    d2I_dN2 = calculate_income_second_derivative(N, params)
-except Exception as e:
+    current_price, dP_dN, current_income, dI_dN, d2I_dN2, *_ = calculate_curves(N, *model_args)
+except MATH_ERRORS as e:
     st.error(f"计算错误: {str(e)}")
     # 使用默认值继续运行
     current_price = params["P_min"] + params["K"]
@@ -196,105 +167,273 @@ with cond_col3:
                 unsafe_allow_html=True)
     st.write("收入增长应呈现上凸趋势（合理减速但仍保持增长）")
 
-# 生成图表数据
-try:
-    N_values = np.linspace(1, 200, 400)
-    P_values = [calculate_price(n, params) for n in N_values]
-    I_values = [calculate_income(n, params) for n in N_values]
+# 生成图表数据（按模型参数缓存，调整实际人数N时无需重新计算）
+@st.cache_data
+def compute_curves(P_min, K, q, N0, C, r, N1, high_res=False):
+    """计算价格、收入及其导数曲线"""
+    N_values = N_GRID_HIGH_RES if high_res else N_GRID
+    # 单次遍历网格，同时得到四条曲线及价格组成分解
+    P_values, _, I_values, dI_values, d2I_values, exp_part, hyperbolic_part = calculate_curves(
+        N_values, P_min, K, q, N0, C, r, N1)
+    return N_values, P_values, I_values, dI_values, d2I_values, exp_part, hyperbolic_part
+
+# 曲线数据表（供浏览器端Vega-Lite渲染，无需服务端绘图）
+@st.cache_data
+def curves_frame(curves):
+    """将曲线数据整理为DataFrame"""
+    N_values, P_values, I_values, dI_values, d2I_values, *_ = curves
+    return pd.DataFrame({"N": N_values, "P": P_values, "I": I_values,
+                         "dI": dI_values, "d2I": d2I_values}).astype(np.float32)
+
+def curve_chart(data, column, title, y_title, color, N, current, zero_line=False, region=None):
+    """单条曲线，并用红色虚线和圆点标出当前值
     
-    # 确保导数计算使用相同的参数
-    dI_values = [calculate_income_derivative(n, params) for n in N_values]
-    d2I_values = [calculate_income_second_derivative(n, params) for n in N_values]
+    region=(符号, 文字, 颜色) 时，用浅色区域标出曲线为正（符号>0）或为负（符号<0）的区间
+    """
+    line = alt.Chart(data).mark_line(color=color, strokeWidth=2).encode(
+        x=alt.X("N:Q", title="人数 (N)"),
+        y=alt.Y(f"{column}:Q", title=y_title),
+        tooltip=[alt.Tooltip("N:Q", format=".1f"), alt.Tooltip(f"{column}:Q", format=".4f")],
+    )
+    marker = pd.DataFrame({"N": [N], column: [current]})
+    v_rule = alt.Chart(marker).mark_rule(color="red", strokeDash=[4, 4], opacity=0.5).encode(x="N:Q")
+    h_rule = alt.Chart(marker).mark_rule(color="red", strokeDash=[4, 4], opacity=0.5).encode(y=f"{column}:Q")
+    point = alt.Chart(marker).mark_point(color="red", filled=True, size=80).encode(x="N:Q", y=f"{column}:Q")
+    layers = [line, v_rule, h_rule, point]
     
-    # 确保所有值都是数值类型
-    dI_values = np.array(dI_values, dtype=float)
-    d2I_values = np.array(d2I_values, dtype=float)
+    if zero_line:
+        zero = pd.DataFrame({column: [0.0]})
+        layers.insert(0, alt.Chart(zero).mark_rule(color="black", opacity=0.3).encode(y=f"{column}:Q"))
+    
+    if region is not None:
+        sign, label, region_color = region
+        if sign > 0:
+            edge = max(float(data[column].max()), 0.1)  # 确保最大值不为零
+        else:
+            edge = min(float(data[column].min()), 0.0)  # 确保最小值合理
+        band = alt.Chart(data).transform_filter(
+            f"datum.{column} {'>' if sign > 0 else '<'} 0"
+        ).transform_calculate(**{column: str(edge * 1.1)}).mark_area(color=region_color, opacity=0.1).encode(
+            x="N:Q",
+            y=alt.Y(f"{column}:Q", title=y_title),
+            y2=alt.datum(0),
+        )
+        text = alt.Chart(pd.DataFrame({"N": [150.0], column: [edge * 0.8]})).mark_text(
+            text=label, color=region_color, fontSize=12, align="left"
+        ).encode(x="N:Q", y=alt.Y(f"{column}:Q", title=y_title))
+        layers[:0] = [band, text]
+    
+    return alt.layer(*layers).properties(title=title, height=380)
+
+@st.cache_data
+def price_parts_frame(curves, P_min):
+    """将已缓存的价格组成分解整理为DataFrame"""
+    N_values, *_, exp_part, hyperbolic_part = curves
+    return pd.DataFrame({
+        "N": N_values,
+        "最低价格": np.full_like(N_values, P_min),
+        "指数部分": P_min + exp_part,
+        "双曲部分": P_min + hyperbolic_part,
+    })
+
+def price_parts_chart(parts):
+    """价格组成分解（最低价格、指数部分、双曲部分）"""
+    return alt.Chart(parts).transform_fold(
+        ["最低价格", "指数部分", "双曲部分"], as_=["组成", "价格"]
+    ).mark_line(strokeDash=[6, 4], opacity=0.7).encode(
+        x="N:Q",
+        y=alt.Y("价格:Q", title=None),  # 与主曲线共用纵轴标题
+        color=alt.Color("组成:N", scale=alt.Scale(range=["green", "cyan", "magenta"]),
+                        legend=alt.Legend(orient="top-right", title=None)),
+    )
+
+# 导出用静态图表骨架（坐标轴、标签和线条对象只创建一次，之后仅更新数据）
+@st.cache_resource
+def figure_skeleton():
+    """创建可复用的2x2图表及其线条对象"""
+    # 延迟导入：只有导出PNG时才需要matplotlib，避免拖慢首次加载
+    import matplotlib
+    matplotlib.use("Agg")  # 仅用于离屏导出PNG，显式指定避免探测GUI后端
+    import matplotlib.pyplot as plt
     
-except Exception as e:
-    st.error(f"图表数据生成错误: {str(e)}")
-    # 使用默认数据继续运行
-    N_values = np.linspace(1, 200, 400)
-    P_values = [params["P_min"] + params["K"] for _ in N_values]
-    I_values = [(params["P_min"] + params["K"]) * n for n in N_values]
-    dI_values = np.zeros(len(N_values))
-    d2I_values = np.zeros(len(N_values))
-
-# 创建图表
-try:
     fig, ((ax1, ax2), (ax3, ax4)) = plt.subplots(2, 2, figsize=(16, 12))
-
-    # 价格曲线
-    ax1.plot(N_values, P_values, 'b-', linewidth=2, label='价格曲线')
-    ax1.axvline(N, color='r', linestyle='--', alpha=0.5)
-    ax1.axhline(current_price, color='r', linestyle='--', alpha=0.5)
-    ax1.plot(N, current_price, 'ro', markersize=8)
-    ax1.set_title(f"每人价格 (当前: {current_price:.2f})")
-    ax1.set_xlabel("人数 (N)")
-    ax1.set_ylabel("每人价格")
-    ax1.grid(True, alpha=0.3)
-    ax1.legend()
+    # 固定边距，替代每次导出都要迭代求解的 tight_layout
+    fig.subplots_adjust(left=0.06, right=0.98, top=0.94, bottom=0.07, wspace=0.2, hspace=0.3)
+    panels = (
+        (ax1, 'b-', '价格曲线', "每人价格"),
+        (ax2, 'g-', '收入曲线', "总收入"),
+        (ax3, 'm-', '收入增长率', "收入增长率"),
+        (ax4, 'c-', '收入增长率变化', "收入增长率变化"),
+    )
     
-    # 添加价格组成分解
-    exp_part = [params["K"] * np.exp(-params["q"] * (n / max(params["N0"], 0.1))) for n in N_values]
-    hyperbolic_part = [params["C"] / (1 + (n / max(params["N1"], 0.1)) ** params["r"]) for n in N_values]
-    ax1.plot(N_values, [params["P_min"] for _ in N_values], 'g--', alpha=0.7, label='最低价格')
-    ax1.plot(N_values, [params["P_min"] + e for e in exp_part], 'c--', alpha=0.7, label='指数部分')
-    ax1.plot(N_values, [params["P_min"] + h for h in hyperbolic_part], 'm--', alpha=0.7, label='双曲部分')
-
-    # 收入曲线
-    ax2.plot(N_values, I_values, 'g-', linewidth=2, label='收入曲线')
-    ax2.axvline(N, color='r', linestyle='--', alpha=0.5)
-    ax2.axhline(current_income, color='r', linestyle='--', alpha=0.5)
-    ax2.plot(N, current_income, 'ro', markersize=8)
-    ax2.set_title(f"总收入 (当前: {current_income:.2f})")
-    ax2.set_xlabel("人数 (N)")
-    ax2.set_ylabel("总收入")
-    ax2.grid(True, alpha=0.3)
-    ax2.legend()
-
-    # 收入增长率曲线
-    ax3.plot(N_values, dI_values, 'm-', linewidth=2, label='收入增长率')
-    ax3.axhline(0, color='k', linestyle='-', alpha=0.3)
-    ax3.axvline(N, color='r', linestyle='--', alpha=0.5)
-    ax3.axhline(dI_dN, color='r', linestyle='--', alpha=0.5)
-    ax3.plot(N, dI_dN, 'ro', markersize=8)
-    ax3.set_title(f"收入增长率 (dI/dN, 当前: {dI_dN:.4f})")
-    ax3.set_xlabel("人数 (N)")
-    ax3.set_ylabel("收入增长率")
-    ax3.grid(True, alpha=0.3)
-    ax3.legend()
+    curve_lines, markers = [], []
+    for ax, style, label, ylabel in panels:
+        curve_lines.append(ax.plot([], [], style, linewidth=2, label=label)[0])
+        if ax in (ax3, ax4):
+            ax.axhline(0, color='k', linestyle='-', alpha=0.3)
+        markers.append((
+            ax.axvline(0, color='r', linestyle='--', alpha=0.5),
+            ax.axhline(0, color='r', linestyle='--', alpha=0.5),
+            ax.plot([], [], 'ro', markersize=8)[0],
+        ))
+        ax.set_xlabel("人数 (N)")
+        ax.set_ylabel(ylabel)
+        ax.grid(True, alpha=0.3)
+        ax.legend()
     
-    # 添加理想增长区域
-    if len(dI_values) > 0:
-        max_dI = max(np.max(dI_values), 0.1)  # 确保最大值不为零
-        ax3.fill_between(N_values, 0, max_dI * 1.1, where=(dI_values > 0), color='green', alpha=0.1)
-        ax3.text(150, max_dI * 0.8, "收入增长区", color='green', fontsize=12)
-
-    # 收入增长率变化曲线
-    ax4.plot(N_values, d2I_values, 'c-', linewidth=2, label='收入增长率变化')
-    ax4.axhline(0, color='k', linestyle='-', alpha=0.3)
-    ax4.axvline(N, color='r', linestyle='--', alpha=0.5)
-    ax4.axhline(d2I_dN2, color='r', linestyle='--', alpha=0.5)
-    ax4.plot(N, d2I_dN2, 'ro', markersize=8)
-    ax4.set_title(f"收入增长率变化 (d²I/dN², 当前: {d2I_dN2:.4f})")
-    ax4.set_xlabel("人数 (N)")
-    ax4.set_ylabel("收入增长率变化")
-    ax4.grid(True, alpha=0.3)
-    ax4.legend()
+    # 价格组成分解
+    part_lines = [ax1.plot([], [], style, alpha=0.7, label=label)[0]
+                  for style, label in (('g--', '最低价格'), ('c--', '指数部分'), ('m--', '双曲部分'))]
     
-    # 添加合理减速区域
-    if len(d2I_values) > 0:
-        min_d2I = min(np.min(d2I_values), 0)  # 确保最小值合理
-        ax4.fill_between(N_values, min_d2I * 1.1, 0, where=(d2I_values < 0), color='blue', alpha=0.1)
-        ax4.text(150, min_d2I * 0.8, "合理减速区", color='blue', fontsize=12)
-
-    # 调整布局
-    plt.tight_layout()
-
-    # 显示图表
-    st.pyplot(fig)
-except Exception as e:
-    st.error(f"图表绘制错误: {str(e)}")
+    return {
+        "fig": fig,
+        "axes": (ax1, ax2, ax3, ax4),
+        "curve_lines": curve_lines,
+        "markers": markers,
+        "part_lines": part_lines,
+        "dynamic": [],  # 每次导出时重建的填充区域和文字
+        "lock": threading.Lock(),  # 图表对象跨会话共享，绘制时需加锁
+    }
+
+# 创建图表（缓存渲染后的PNG，避免重复绘制）
+@st.cache_data
+def build_figure(curves, params, current_price, current_income, dI_dN, d2I_dN2):
+    """更新图表骨架中的数据并返回PNG图像数据"""
+    N_values, P_values, I_values, dI_values, d2I_values, exp_part, hyperbolic_part = curves
+    N = params["N"]
+    P_min = params["P_min"]
+    
+    skeleton = figure_skeleton()
+    with skeleton["lock"]:
+        fig = skeleton["fig"]
+        ax1, ax2, ax3, ax4 = skeleton["axes"]
+        
+        for artist in skeleton["dynamic"]:
+            artist.remove()
+        skeleton["dynamic"].clear()
+        
+        # 更新曲线和当前值标记
+        series = (P_values, I_values, dI_values, d2I_values)
+        currents = (current_price, current_income, dI_dN, d2I_dN2)
+        for line, (v_rule, h_rule, point), y_values, current in zip(
+                skeleton["curve_lines"], skeleton["markers"], series, currents):
+            line.set_data(N_values, y_values)
+            v_rule.set_xdata([N, N])
+            h_rule.set_ydata([current, current])
+            point.set_data([N], [current])
+        
+        for line, y_values in zip(skeleton["part_lines"],
+                                  (np.full_like(N_values, P_min), P_min + exp_part, P_min + hyperbolic_part)):
+            line.set_data(N_values, y_values)
+        
+        for ax in skeleton["axes"]:
+            ax.relim()
+            ax.autoscale_view()
+        
+        ax1.set_title(f"每人价格 (当前: {current_price:.2f})")
+        ax2.set_title(f"总收入 (当前: {current_income:.2f})")
+        ax3.set_title(f"收入增长率 (dI/dN, 当前: {dI_dN:.4f})")
+        ax4.set_title(f"收入增长率变化 (d²I/dN², 当前: {d2I_dN2:.4f})")
+        
+        # 添加理想增长区域
+        if len(dI_values) > 0:
+            max_dI = max(np.max(dI_values), 0.1)  # 确保最大值不为零
+            skeleton["dynamic"] += [
+                ax3.fill_between(N_values, 0, max_dI * 1.1, where=(dI_values > 0), color='green', alpha=0.1),
+                ax3.text(150, max_dI * 0.8, "收入增长区", color='green', fontsize=12),
+            ]
+        
+        # 添加合理减速区域
+        if len(d2I_values) > 0:
+            min_d2I = min(np.min(d2I_values), 0)  # 确保最小值合理
+            skeleton["dynamic"] += [
+                ax4.fill_between(N_values, min_d2I * 1.1, 0, where=(d2I_values < 0), color='blue', alpha=0.1),
+                ax4.text(150, min_d2I * 0.8, "合理减速区", color='blue', fontsize=12),
+            ]
+        
+        # 输出为PNG
+        buf = io.BytesIO()
+        fig.savefig(buf, format="png")
+    return buf.getvalue()
+
+# 模型参数未变化时（如只点击了按钮或切换了实际人数N），直接复用上次的曲线数据
+curves_key = (model_args, high_res)
+if st.session_state.get("curves_key") == curves_key:
+    curves = st.session_state.curves
+else:
+    try:
+        curves = compute_curves(*model_args, high_res=high_res)
+        st.session_state.curves_key = curves_key
+        st.session_state.curves = curves
+    except MATH_ERRORS as e:
+        st.error(f"图表数据生成错误: {str(e)}")
+        # 使用默认数据继续运行
+        N_values = N_GRID_HIGH_RES if high_res else N_GRID
+        curves = (
+            N_values,
+            np.full_like(N_values, params["P_min"] + params["K"]),
+            (params["P_min"] + params["K"]) * N_values,
+            np.zeros_like(N_values),
+            np.zeros_like(N_values),
+            np.full_like(N_values, params["K"]),
+            np.zeros_like(N_values),
+        )
+
+# 交互式图表及PNG导出（可在侧边栏关闭）
+if st.session_state.get("show_plot", True):
+    try:
+        chart_data = curves_frame(curves)
+        chart_col1, chart_col2 = st.columns(2)
+        
+        with chart_col1:
+            price_chart = curve_chart(chart_data, "P", f"每人价格 (当前: {current_price:.2f})",
+                                      "每人价格", "blue", N, current_price)
+            st.altair_chart(price_chart + price_parts_chart(price_parts_frame(curves, params["P_min"])), use_container_width=True)
+            st.altair_chart(curve_chart(chart_data, "dI", f"收入增长率 (dI/dN, 当前: {dI_dN:.4f})",
+                                        "收入增长率", "magenta", N, dI_dN, zero_line=True,
+                                        region=(1, "收入增长区", "green")),
+                            use_container_width=True)
+        
+        with chart_col2:
+            st.altair_chart(curve_chart(chart_data, "I", f"总收入 (当前: {current_income:.2f})",
+                                        "总收入", "green", N, current_income),
+                            use_container_width=True)
+            st.altair_chart(curve_chart(chart_data, "d2I", f"收入增长率变化 (d²I/dN², 当前: {d2I_dN2:.4f})",
+                                        "收入增长率变化", "cyan", N, d2I_dN2, zero_line=True,
+                                        region=(-1, "合理减速区", "blue")),
+                            use_container_width=True)
+    except Exception as e:
+        st.error(f"图表绘制错误: {str(e)}")
+
+    # 导出PNG图表：生成结果保存在会话中，点击下载引发的重跑后下载按钮依然可用
+    png_key = (curves_key, N)
+    if st.button("🖼️ 生成PNG图表"):
+        try:
+            st.session_state.png = build_figure(curves, params, current_price, current_income, dI_dN, d2I_dN2)
+            st.session_state.png_key = png_key
+        except Exception as e:
+            st.error(f"图表绘制错误: {str(e)}")
+    
+    # 参数变化后旧图片不再对应当前结果，需重新生成
+    if st.session_state.get("png_key") == png_key:
+        st.download_button(
+            "📥 下载PNG图表",
+            data=st.session_state.png,
+            file_name="price_model.png",
+            mime="image/png",
+        )
+
+# 曲线数据表（由前端按列格式化数字，避免逐单元格生成字符串）
+if st.checkbox("📋 显示曲线数据表"):
+    table_labels = {"N": "人数 (N)", "P": "每人价格", "I": "总收入",
+                    "dI": "收入增长率 (dI/dN)", "d2I": "收入增长率变化 (d²I/dN²)"}
+    st.dataframe(
+        curves_frame(curves),
+        height=300,
+        hide_index=True,
+        column_config={col: st.column_config.NumberColumn(label, format="%.2f")
+                       for col, label in table_labels.items()},
+    )
 
 # 参数影响分析
 st.subheader("🔍 参数影响分析")
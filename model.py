@@ -0,0 +1,52 @@
+"""改进的价格模型：P(N) = P_min + K*exp(-q*(N/N0)) + C/(1+(N/N1)^r) 及其收入、导数计算
+
+calculate_curves 支持标量和NumPy数组输入，与Streamlit界面无关，可单独复用。
+"""
+import numpy as np
+
+# 数值计算可能出现的异常（N0、N1 已在 unpack_params 中校验）
+MATH_ERRORS = (ValueError, ZeroDivisionError, FloatingPointError, OverflowError)
+
+def unpack_params(params):
+    """一次性取出模型参数为元组 (P_min, K, q, N0, C, r, N1)，并避免除以零错误"""
+    N0 = params["N0"] if params["N0"] > 0 else 1.0
+    N1 = params["N1"] if params["N1"] > 0 else 1.0
+    return params["P_min"], params["K"], params["q"], N0, params["C"], params["r"], N1
+
+def calculate_curves(N, P_min, K, q, N0, C, r, N1):
+    """一次性计算 P(N)、P'(N)、I(N)、I'(N)、I''(N)，共享指数与幂运算的中间结果
+    
+    同时返回价格的指数部分和双曲部分，供价格组成分解图直接复用
+    
+    导数均为解析式（记 a = q/N0，g = (N/N1)^r，H = C/(1+g)）：
+        P'(N)  = -a*K*exp(-a*N) - r*g*H / (N*(1+g))
+        P''(N) = a^2*K*exp(-a*N) + r*g*H / (N^2*(1+g)) * (2*r*g/(1+g) - (r-1))
+        I'(N)  = P(N) + N*P'(N)，I''(N) = 2*P'(N) + N*P''(N)
+    """
+    Nc = np.maximum(N, 0.1)
+    a = q / N0
+    
+    # 先合并标量常数，再原地运算，减少临时数组的分配
+    exp_part = np.exp(Nc * -a)
+    exp_part *= K
+    g = Nc / N1
+    g **= r
+    # 幂运算只做一次：P'、P'' 中的 (1+g)^-2、(1+g)^-3 由倒数逐次相乘得到
+    inv_1g = 1 / (g + 1)
+    inv_N = 1 / Nc
+    hyperbolic_part = C * inv_1g
+    w = g * inv_1g  # g/(1+g)
+    
+    P = exp_part + hyperbolic_part
+    P += P_min
+    hyp_ratio = w * hyperbolic_part
+    hyp_ratio *= r * inv_N
+    dP = exp_part * -a
+    dP -= hyp_ratio
+    d2P = w * (2 * r)
+    d2P -= r - 1
+    d2P *= hyp_ratio
+    d2P *= inv_N
+    d2P += exp_part * a**2
+    
+    return P, dP, P * N, P + N * dP, 2 * dP + N * d2P, exp_part, hyperbolic_part